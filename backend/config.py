@@ -11,6 +11,7 @@ class Settings(BaseSettings):
     # OpenAI
     openai_api_key: str = ""
     openai_model: str = "gpt-4o-mini"
+    openai_base_url: str = ""  # Override for OpenAI-compatible servers (e.g. tools.fake_upstream)
     
     # Database
     database_url: str = "postgresql://postgres:postgres@db:5432/elon_ai"
@@ -19,6 +20,26 @@ class Settings(BaseSettings):
     max_response_time: int = 60  # seconds
     debug: bool = False
     
+    # Speculative follow-up prefetch (disabled by default)
+    prefetch_enabled: bool = False
+    prefetch_cache_size: int = 128
+    prefetch_ttl_seconds: int = 300
+    prefetch_max_inflight: int = 2  # Skip prefetch when upstream is busier than this
+    prefetch_token_budget_ratio: float = 0.7  # Stop prefetching above 70% of daily tokens
+    
+    # Hot-reloadable persona/limits file (disabled when empty)
+    runtime_config_path: str = ""
+    runtime_config_poll_seconds: float = 5.0
+    
+    # Usage analytics rollups
+    analytics_max_keys: int = 64  # Aggregates per time bucket before new keys fold into "other"
+    analytics_compression: int = 50  # t-digest compression (centroids per latency digest)
+    
+    # Memory caps and diagnostics
+    usage_max_records: int = 10000  # Stored usage records; runtime limits may not set max_requests_per_day above it
+    ws_max_conversations: int = 8  # Conversations multiplexed per WebSocket connection
+    memory_tracing: bool = False  # Enable tracemalloc snapshots in /debug/memory
+    
     class Config:
         env_file = ".env"
         extra = "ignore"
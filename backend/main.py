@@ -1,7 +1,7 @@
 """
 Elon-Inspired Strategic Dialogue AI - Backend API
 """
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 import logging
@@ -9,6 +9,10 @@ import logging
 from routers import chat
 from config import settings
 from rate_limiter import limiter
+from services.memory_monitor import build_memory_report, start_tracing
+from services.usage_tracker import usage_tracker
+from services.runtime_config import RuntimeConfigWatcher
+from services.conversation_store import ConversationStore
 from slowapi import _rate_limit_exceeded_handler
 from slowapi.errors import RateLimitExceeded
 
@@ -22,7 +26,24 @@ async def lifespan(app: FastAPI):
     """Application lifespan handler"""
     logger.info("🚀 Starting Elon AI Backend...")
     logger.info(f"OpenAI API Key configured: {'Yes' if settings.openai_api_key else 'No'}")
+    if settings.memory_tracing:
+        start_tracing()
+    
+    config_watcher = None
+    if settings.runtime_config_path:
+        config_watcher = RuntimeConfigWatcher(
+            path=settings.runtime_config_path,
+            poll_seconds=settings.runtime_config_poll_seconds,
+            engine=chat.thinking_engine,
+            tracker=usage_tracker
+        )
+        await config_watcher.check_once()
+        config_watcher.start()
+    
     yield
+    
+    if config_watcher:
+        await config_watcher.stop()
     logger.info("👋 Shutting down Elon AI Backend...")
 
 
@@ -58,10 +79,28 @@ async def health_check():
     return {
         "status": "healthy",
         "service": "elon-ai-backend",
-        "version": "1.0.0"
+        "version": "1.0.0",
+        "config_version": chat.thinking_engine.persona.version
     }
 
 
+@app.get("/debug/memory")
+async def debug_memory(limit: int = 10):
+    """
+    Memory usage per in-process structure (debug mode only)
+    Allocation sites are included when MEMORY_TRACING is enabled
+    """
+    if not settings.debug:
+        raise HTTPException(status_code=404, detail="Not Found")
+    
+    return build_memory_report({
+        "usage_tracker": usage_tracker.get_memory_stats(),
+        "prefetch_cache": chat.prefetcher.get_memory_stats(),
+        "usage_analytics": chat.usage_analytics.get_memory_stats(),
+        "ws_conversations": ConversationStore.get_total_memory_stats()
+    }, limit=limit)
+
+
 @app.get("/")
 async def root():
     """Root endpoint"""
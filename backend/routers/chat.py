@@ -2,18 +2,27 @@
 Chat API Router
 Handles conversation endpoints for the Elon AI dialogue system
 """
-from fastapi import APIRouter, HTTPException, Request
+from fastapi import APIRouter, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.requests import HTTPConnection
 from fastapi.responses import StreamingResponse
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, ValidationError
 from typing import Optional, List
 from datetime import datetime
+from functools import partial
 import asyncio
+import inspect
+import json
 import logging
+import struct
 
 from services.thinking_engine import ThinkingEngine
 from services.openai_client import OpenAIClient
 from services.usage_tracker import usage_tracker
+from services.prefetcher import FollowUpPrefetcher
+from services.analytics import DIMENSIONS, GRANULARITIES, UsageAnalytics
+from services.conversation_store import ConversationStore
 from rate_limiter import limiter
+from config import settings
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
@@ -21,6 +30,38 @@ router = APIRouter()
 # Initialize services
 thinking_engine = ThinkingEngine()
 openai_client = OpenAIClient()
+usage_analytics = UsageAnalytics(
+    max_keys=settings.analytics_max_keys,
+    compression=settings.analytics_compression
+)
+prefetcher = FollowUpPrefetcher(thinking_engine, openai_client, usage_tracker, analytics=usage_analytics)
+
+# Token count recorded for a stream when upstream does not report usage
+STREAM_TOKENS_FALLBACK = 500
+
+# Max length of a client label in analytics
+CLIENT_ID_MAX_LENGTH = 64
+
+
+def _client_id(conn: HTTPConnection) -> str:
+    """Client label for analytics: X-Client-Id header, else remote address"""
+    client = conn.headers.get("x-client-id") or (conn.client.host if conn.client else "unknown")
+    return client[:CLIENT_ID_MAX_LENGTH]
+
+
+def _record_analytics(conn: HTTPConnection, mode: str, start_time: datetime, usage: Optional[dict] = None, error: bool = False):
+    """Feed one finished request into the usage analytics rollups"""
+    usage = usage or {}
+    usage_analytics.record(
+        mode=mode,
+        model=openai_client.model,
+        client=_client_id(conn),
+        latency_ms=(datetime.now() - start_time).total_seconds() * 1000,
+        prompt_tokens=usage.get("prompt_tokens", 0),
+        completion_tokens=usage.get("completion_tokens", 0),
+        error=error
+    )
+
 
 class ChatMessage(BaseModel):
     """Single chat message"""
@@ -33,7 +74,7 @@ class ChatRequest(BaseModel):
     """Chat request payload"""
     message: str = Field(..., min_length=1, max_length=2000, description="User's message (max 2000 chars)")
     conversation_history: Optional[List[ChatMessage]] = Field(default=[], description="Previous messages")
-    mode: Optional[str] = Field(default="standard", description="Thinking mode: 'standard', 'first_principles', 'strategy'")
+    mode: Optional[str] = Field(default="standard", max_length=64, description="Thinking mode: 'standard', 'first_principles', 'strategy'")
 
 
 class ChatResponse(BaseModel):
@@ -42,6 +83,7 @@ class ChatResponse(BaseModel):
     thinking_process: Optional[str] = Field(None, description="Simplified thinking process (optional)")
     response_time_ms: int = Field(..., description="Response time in milliseconds")
     mode_used: str = Field(..., description="Thinking mode applied")
+    config_version: str = Field(..., description="Persona/limits config version used")
 
 
 @router.post("/chat", response_model=ChatResponse)
@@ -60,6 +102,7 @@ async def chat(request: ChatRequest, req: Request):
         logger.warning(f"Rate limit exceeded: {reason}")
         raise HTTPException(status_code=429, detail=reason)
     
+    mode_used = request.mode
     try:
         logger.info(f"Received chat request: {request.message[:50]}...")
         
@@ -69,40 +112,62 @@ async def chat(request: ChatRequest, req: Request):
             mode=request.mode,
             history=request.conversation_history
         )
+        mode_used = enhanced_prompt["mode"]
         
-        # Get response from OpenAI with timeout
-        try:
-            response = await asyncio.wait_for(
-                openai_client.get_response(enhanced_prompt),
-                timeout=60.0  # 60 second max
-            )
-        except asyncio.TimeoutError:
-            raise HTTPException(
-                status_code=504,
-                detail="Response timeout. Processing took longer than 60 seconds."
-            )
+        # Serve a speculatively prefetched answer if one is ready
+        response = prefetcher.lookup(enhanced_prompt)
+        if response is not None:
+            # Tokens were already counted (and attributed) when the prefetch ran
+            total_tokens = 0
+            spent_usage = None
+        else:
+            # Get response from OpenAI with timeout
+            try:
+                response = await asyncio.wait_for(
+                    openai_client.get_response(enhanced_prompt),
+                    timeout=60.0  # 60 second max
+                )
+            except asyncio.TimeoutError:
+                raise HTTPException(
+                    status_code=504,
+                    detail="Response timeout. Processing took longer than 60 seconds."
+                )
+            
+            total_tokens = response.get("usage", {}).get("prompt_tokens", 0) + response.get("usage", {}).get("completion_tokens", 0)
+            spent_usage = response.get("usage")
         
         # Record usage for rate limiting
-        total_tokens = response.get("usage", {}).get("prompt_tokens", 0) + response.get("usage", {}).get("completion_tokens", 0)
         usage_tracker.record_request(total_tokens)
         
+        # Precompute likely follow-ups while there is spare capacity
+        prefetcher.schedule(
+            user_message=request.message,
+            answer=response["content"],
+            mode=request.mode,
+            history=request.conversation_history
+        )
+        
         # Calculate response time
         end_time = datetime.now()
         response_time_ms = int((end_time - start_time).total_seconds() * 1000)
         
         logger.info(f"Response generated in {response_time_ms}ms, tokens used: {total_tokens}")
+        _record_analytics(req, mode_used, start_time, usage=spent_usage)
         
         return ChatResponse(
             message=response["content"],
             thinking_process=response.get("thinking_summary"),
             response_time_ms=response_time_ms,
-            mode_used=request.mode
+            mode_used=request.mode,
+            config_version=enhanced_prompt["config_version"]
         )
         
     except HTTPException:
+        _record_analytics(req, mode_used, start_time, error=True)
         raise
     except Exception as e:
         logger.error(f"Chat error: {str(e)}")
+        _record_analytics(req, mode_used, start_time, error=True)
         raise HTTPException(status_code=500, detail=f"Internal error: {str(e)}")
 
 
@@ -113,6 +178,8 @@ async def chat_stream(request: ChatRequest, req: Request):
     Streaming chat endpoint for real-time responses
     Rate limited to stay within free tier
     """
+    start_time = datetime.now()
+    
     # Check rate limit FIRST
     allowed, reason = usage_tracker.can_make_request()
     if not allowed:
@@ -126,11 +193,17 @@ async def chat_stream(request: ChatRequest, req: Request):
         )
         
         async def generate():
-            async for chunk in openai_client.get_response_stream(enhanced_prompt):
-                yield f"data: {chunk}\n\n"
+            usage = {}
+            try:
+                async for chunk in openai_client.get_response_stream(enhanced_prompt, usage=usage):
+                    yield f"data: {chunk}\n\n"
+            except Exception:
+                _record_analytics(req, enhanced_prompt["mode"], start_time, error=True)
+                raise
             yield "data: [DONE]\n\n"
-            # Record usage (approximate for streaming)
-            usage_tracker.record_request(500)
+            # Record usage (approximate if upstream did not report it)
+            usage_tracker.record_request(usage.get("total_tokens", STREAM_TOKENS_FALLBACK))
+            _record_analytics(req, enhanced_prompt["mode"], start_time, usage=usage)
         
         return StreamingResponse(
             generate(),
@@ -138,6 +211,7 @@ async def chat_stream(request: ChatRequest, req: Request):
             headers={
                 "Cache-Control": "no-cache",
                 "Connection": "keep-alive",
+                "X-Config-Version": enhanced_prompt["config_version"],
             }
         )
         
@@ -148,6 +222,163 @@ async def chat_stream(request: ChatRequest, req: Request):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# WebSocket binary frame: 1-byte frame type + 4-byte conversation id, then UTF-8 payload
+WS_FRAME_HEADER = struct.Struct(">BI")
+WS_FRAME_DELTA = 0x01
+WS_FRAME_DONE = 0x02
+WS_FRAME_ERROR = 0x03
+WS_FRAME_CANCELLED = 0x04
+
+# Per-connection history window
+WS_HISTORY_LENGTH = 10  # Matches the history window used by ThinkingEngine
+
+
+def _ws_frame(frame_type: int, conversation_id: int, payload: str = "") -> bytes:
+    """Encode a server-to-client WebSocket frame"""
+    return WS_FRAME_HEADER.pack(frame_type, conversation_id) + payload.encode("utf-8")
+
+
+@router.websocket("/chat/ws")
+async def chat_websocket(websocket: WebSocket):
+    """
+    Persistent chat transport multiplexing several conversations per connection
+    
+    Client -> server (JSON text frames):
+        {"type": "chat", "id": 1, "message": "...", "mode": "auto", "conversation_history": [...]}
+        {"type": "cancel", "id": 1}   # stop the in-progress answer
+        {"type": "end", "id": 1}      # forget the conversation
+    conversation_history is only needed to seed a conversation; afterwards the
+    server keeps the history, so each message carries just the new text.
+    
+    Server -> client (binary frames, see WS_FRAME_HEADER):
+        DELTA (text chunk), DONE (JSON with mode_used, response_time_ms, config_version),
+        ERROR (message), CANCELLED (empty)
+    """
+    await websocket.accept()
+    conversations = ConversationStore(settings.ws_max_conversations, WS_HISTORY_LENGTH)
+    tasks: dict = {}
+    
+    async def run_turn(conversation_id: int, request: ChatRequest, history: list):
+        start_time = datetime.now()
+        chunks = []
+        usage = {}
+        mode_used = request.mode
+        failed = False
+        try:
+            enhanced_prompt = thinking_engine.apply_thinking_style(
+                user_message=request.message,
+                mode=request.mode,
+                history=history
+            )
+            mode_used = enhanced_prompt["mode"]
+            async for chunk in openai_client.get_response_stream(enhanced_prompt, usage=usage):
+                chunks.append(chunk)
+                await websocket.send_bytes(_ws_frame(WS_FRAME_DELTA, conversation_id, chunk))
+            
+            conversations.append_turn(conversation_id, request.message, "".join(chunks))
+            
+            response_time_ms = int((datetime.now() - start_time).total_seconds() * 1000)
+            await websocket.send_bytes(_ws_frame(WS_FRAME_DONE, conversation_id, json.dumps({
+                "mode_used": mode_used,
+                "response_time_ms": response_time_ms,
+                "config_version": enhanced_prompt["config_version"]
+            })))
+        except asyncio.CancelledError:
+            try:
+                await websocket.send_bytes(_ws_frame(WS_FRAME_CANCELLED, conversation_id))
+            except Exception:
+                pass  # Connection already closed
+            raise
+        except Exception as e:
+            failed = True
+            logger.error(f"WebSocket chat error: {str(e)}")
+            await websocket.send_bytes(_ws_frame(WS_FRAME_ERROR, conversation_id, f"Internal error: {str(e)}"))
+        finally:
+            # The request itself was counted at admission; add its tokens on
+            # every exit path so cancelled and failed turns still hit the budget
+            usage_tracker.record_tokens(usage.get("total_tokens", STREAM_TOKENS_FALLBACK))
+            _record_analytics(websocket, mode_used, start_time, usage=usage, error=failed)
+    
+    async def cancel_turn(conversation_id: int):
+        task = tasks.get(conversation_id)
+        if task is None:
+            return
+        # A task cancelled before its first step never runs run_turn's
+        # handlers, so CANCELLED has to be sent from here
+        not_started = inspect.getcoroutinestate(task.get_coro()) == inspect.CORO_CREATED
+        task.cancel()
+        if not_started:
+            del tasks[conversation_id]
+            await websocket.send_bytes(_ws_frame(WS_FRAME_CANCELLED, conversation_id))
+    
+    def forget_task(conversation_id: int, task: asyncio.Task):
+        # Runs however the task ended, including cancellation before it started
+        if tasks.get(conversation_id) is task:
+            del tasks[conversation_id]
+    
+    try:
+        while True:
+            try:
+                payload = json.loads(await websocket.receive_text())
+                conversation_id = int(payload.get("id", 0))
+                WS_FRAME_HEADER.pack(0, conversation_id)  # Reject ids outside uint32
+            except (ValueError, TypeError, AttributeError, KeyError, struct.error):
+                await websocket.send_bytes(_ws_frame(WS_FRAME_ERROR, 0, "Invalid frame"))
+                continue
+            
+            if payload.get("type") == "cancel":
+                await cancel_turn(conversation_id)
+                continue
+            
+            if payload.get("type") == "end":
+                await cancel_turn(conversation_id)
+                conversations.end(conversation_id)
+                continue
+            
+            if payload.get("type") != "chat":
+                await websocket.send_bytes(_ws_frame(WS_FRAME_ERROR, conversation_id, "Unknown frame type"))
+                continue
+            
+            if conversation_id in tasks:
+                await websocket.send_bytes(_ws_frame(WS_FRAME_ERROR, conversation_id, "Response already in progress"))
+                continue
+            
+            if not conversations.can_open(conversation_id):
+                await websocket.send_bytes(_ws_frame(
+                    WS_FRAME_ERROR, conversation_id,
+                    f"1接続あたりの会話数は{settings.ws_max_conversations}件までです。"
+                ))
+                continue
+            
+            try:
+                request = ChatRequest(**{k: v for k, v in payload.items() if k not in ("type", "id")})
+            except ValidationError as e:
+                await websocket.send_bytes(_ws_frame(WS_FRAME_ERROR, conversation_id, str(e)))
+                continue
+            
+            # Check rate limit FIRST
+            allowed, reason = usage_tracker.can_make_request()
+            if not allowed:
+                await websocket.send_bytes(_ws_frame(WS_FRAME_ERROR, conversation_id, reason))
+                continue
+            
+            # Count the request before starting it, so a cancel that arrives
+            # before the turn even runs cannot slip past the rate limits
+            usage_tracker.record_request(0)
+            # Creating the history here reserves the conversation slot, so
+            # several new ids admitted before their tasks start still count
+            history = conversations.history(conversation_id, seed=request.conversation_history)
+            task = asyncio.create_task(run_turn(conversation_id, request, history))
+            task.add_done_callback(partial(forget_task, conversation_id))
+            tasks[conversation_id] = task
+    
+    except WebSocketDisconnect:
+        logger.info("WebSocket client disconnected")
+    finally:
+        for task in list(tasks.values()):
+            task.cancel()
+
+
 @router.get("/modes")
 async def get_thinking_modes():
     """
@@ -180,4 +411,46 @@ async def get_usage_stats():
     Get current API usage statistics
     Helps monitor free tier usage
     """
-    return usage_tracker.get_usage_stats()
+    stats = usage_tracker.get_usage_stats()
+    stats["prefetch"] = prefetcher.get_stats()
+    return stats
+
+
+def _parse_breakdown_query(granularity: str, group_by: str, window: Optional[int]) -> tuple:
+    if granularity not in GRANULARITIES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"granularity must be one of: {', '.join(GRANULARITIES)}"
+        )
+    _, slots = GRANULARITIES[granularity]
+    if window is not None and not 1 <= window <= slots:
+        raise HTTPException(
+            status_code=400,
+            detail=f"window must be between 1 and {slots} for granularity '{granularity}'"
+        )
+    dimensions = tuple(d.strip() for d in group_by.split(",") if d.strip())
+    if not dimensions or any(d not in DIMENSIONS for d in dimensions):
+        raise HTTPException(
+            status_code=400,
+            detail=f"group_by must be a comma-separated subset of: {', '.join(DIMENSIONS)}"
+        )
+    return granularity, dimensions
+
+
+@router.get("/usage/breakdown")
+async def get_usage_breakdown(granularity: str = "hour", group_by: str = "mode", window: Optional[int] = None):
+    """
+    Cost and latency totals over the last `window` buckets
+    Grouped by any of: mode, model, client, prompt_size
+    """
+    granularity, dimensions = _parse_breakdown_query(granularity, group_by, window)
+    return usage_analytics.breakdown(granularity, dimensions, window)
+
+
+@router.get("/usage/breakdown/series")
+async def get_usage_breakdown_series(granularity: str = "minute", group_by: str = "mode", window: Optional[int] = None):
+    """
+    Per-bucket cost and latency rollups for charting
+    """
+    granularity, dimensions = _parse_breakdown_query(granularity, group_by, window)
+    return usage_analytics.series(granularity, dimensions, window)
@@ -0,0 +1,329 @@
+"""
+Usage Analytics Service
+Streaming cost/latency rollups per mode, model, client and prompt size
+
+Requests are folded into ring buffers of minute, hour and day buckets.
+Each bucket holds a bounded number of aggregates, each with a t-digest for
+latency quantiles, so memory stays fixed no matter how much traffic arrives.
+"""
+from array import array
+from bisect import bisect_right
+from typing import Dict, Iterable, List, Optional, Tuple
+import logging
+import math
+import time
+
+logger = logging.getLogger(__name__)
+
+# Granularity -> (bucket size in seconds, number of buckets kept)
+GRANULARITIES = {
+    "minute": (60, 60),
+    "hour": (60 * 60, 24),
+    "day": (24 * 60 * 60, 30),
+}
+
+DIMENSIONS = ("mode", "model", "client", "prompt_size")
+
+# Prompt size bands (upper bounds in prompt tokens) used for the prompt_size dimension
+PROMPT_SIZE_BANDS = ((1000, "<1k"), (2000, "1k-2k"), (4000, "2k-4k"))
+PROMPT_SIZE_OVERFLOW = "4k+"
+
+# List prices in USD per 1M tokens: (input, output)
+MODEL_PRICES_PER_1M = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+}
+DEFAULT_MODEL = "gpt-4o-mini"
+
+# Key every new combination folds into once a bucket holds max_keys aggregates.
+# All dimensions are replaced, since mode (like client) comes from the request.
+OVERFLOW_LABEL = "other"
+OVERFLOW_KEY = (OVERFLOW_LABEL,) * len(DIMENSIONS)
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """Estimated USD cost of a request; unknown models use gpt-4o-mini prices"""
+    input_price, output_price = MODEL_PRICES_PER_1M.get(model, MODEL_PRICES_PER_1M[DEFAULT_MODEL])
+    return (prompt_tokens * input_price + completion_tokens * output_price) / 1_000_000
+
+
+def prompt_size_band(prompt_tokens: int) -> str:
+    for upper, label in PROMPT_SIZE_BANDS:
+        if prompt_tokens < upper:
+            return label
+    return PROMPT_SIZE_OVERFLOW
+
+
+class TDigest:
+    """
+    Merging t-digest for streaming quantile estimates in bounded memory
+
+    Values are buffered and folded into at most ~compression centroids
+    when the buffer fills, so add() is an append in the common case.
+    """
+
+    __slots__ = ("compression", "means", "weights", "_buffer", "count", "min", "max")
+
+    BUFFER_SIZE = 32
+
+    def __init__(self, compression: int = 50):
+        self.compression = compression
+        self.means = array("d")
+        self.weights = array("d")
+        self._buffer: List[float] = []
+        self.count = 0
+        self.min = float("inf")
+        self.max = float("-inf")
+
+    def add(self, value: float):
+        self._buffer.append(value)
+        self.count += 1
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        if len(self._buffer) >= self.BUFFER_SIZE:
+            self._compress()
+
+    def merge(self, other: "TDigest"):
+        """Fold another digest into this one"""
+        if other.count == 0:
+            return
+        other._compress()
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._compress(zip(other.means, other.weights))
+
+    def _scale(self, q: float) -> float:
+        return self.compression / (2 * math.pi) * math.asin(2 * min(q, 1.0) - 1)
+
+    def _compress(self, extra: Iterable[Tuple[float, float]] = ()):
+        points = list(zip(self.means, self.weights))
+        points.extend((value, 1.0) for value in self._buffer)
+        points.extend(extra)
+        self._buffer = []
+        if not points:
+            return
+        points.sort()
+
+        total = sum(weight for _, weight in points)
+        means = array("d")
+        weights = array("d")
+        cur_mean, cur_weight = points[0]
+        cumulative = 0.0
+        k_lower = self._scale(0.0)
+        for mean, weight in points[1:]:
+            # k1 scale: centroids may span at most one unit of k, keeping tails fine-grained
+            if self._scale((cumulative + cur_weight + weight) / total) - k_lower <= 1:
+                cur_weight += weight
+                cur_mean += (mean - cur_mean) * weight / cur_weight
+            else:
+                means.append(cur_mean)
+                weights.append(cur_weight)
+                cumulative += cur_weight
+                k_lower = self._scale(cumulative / total)
+                cur_mean, cur_weight = mean, weight
+        means.append(cur_mean)
+        weights.append(cur_weight)
+        self.means = means
+        self.weights = weights
+
+    def quantile(self, q: float) -> float:
+        """Estimated value at quantile q (0..1); 0.0 when empty"""
+        if self.count == 0:
+            return 0.0
+        self._compress()
+        if len(self.means) == 1:
+            return self.means[0]
+
+        # Interpolate between centroid midpoints by cumulative weight
+        target = q * self.count
+        midpoints = []
+        cumulative = 0.0
+        for weight in self.weights:
+            midpoints.append(cumulative + weight / 2)
+            cumulative += weight
+
+        if target <= midpoints[0]:
+            return self.min + (self.means[0] - self.min) * target / midpoints[0] if midpoints[0] else self.min
+        if target >= midpoints[-1]:
+            tail = self.count - midpoints[-1]
+            return self.means[-1] + (self.max - self.means[-1]) * (target - midpoints[-1]) / tail if tail else self.max
+
+        i = bisect_right(midpoints, target) - 1
+        span = midpoints[i + 1] - midpoints[i]
+        return self.means[i] + (self.means[i + 1] - self.means[i]) * (target - midpoints[i]) / span
+
+
+class _Aggregate:
+    """Running totals for one dimension key within one time bucket"""
+
+    __slots__ = ("requests", "errors", "prompt_tokens", "completion_tokens", "cost_usd", "latency")
+
+    def __init__(self, compression: int):
+        self.requests = 0
+        self.errors = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost_usd = 0.0
+        self.latency = TDigest(compression)
+
+    def merge(self, other: "_Aggregate"):
+        self.requests += other.requests
+        self.errors += other.errors
+        self.prompt_tokens += other.prompt_tokens
+        self.completion_tokens += other.completion_tokens
+        self.cost_usd += other.cost_usd
+        self.latency.merge(other.latency)
+
+    def to_dict(self) -> dict:
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "estimated_cost_usd": round(self.cost_usd, 6),
+            "latency_ms": {
+                "p50": round(self.latency.quantile(0.5), 1),
+                "p90": round(self.latency.quantile(0.9), 1),
+                "p99": round(self.latency.quantile(0.99), 1),
+                "max": round(self.latency.max, 1) if self.latency.count else 0.0
+            }
+        }
+
+
+class _Bucket:
+    __slots__ = ("start", "aggregates")
+
+    def __init__(self, start: int):
+        self.start = start
+        self.aggregates: Dict[tuple, _Aggregate] = {}
+
+
+class UsageAnalytics:
+    """
+    Fixed-memory rollups of request cost and latency
+
+    Memory is bounded by sum(buckets) * (max_keys + 1) aggregates (the extra
+    one being the overflow key), each holding a t-digest of at most
+    ~compression centroids.
+    """
+
+    def __init__(self, max_keys: int = 64, compression: int = 50, clock=time.time):
+        self.max_keys = max_keys
+        self.compression = compression
+        self._clock = clock
+        self._rings: Dict[str, List[Optional[_Bucket]]] = {
+            name: [None] * slots for name, (_, slots) in GRANULARITIES.items()
+        }
+
+    def _bucket(self, granularity: str, now: float) -> _Bucket:
+        size, slots = GRANULARITIES[granularity]
+        start = int(now // size) * size
+        ring = self._rings[granularity]
+        index = (start // size) % slots
+        bucket = ring[index]
+        if bucket is None or bucket.start != start:
+            bucket = ring[index] = _Bucket(start)
+        return bucket
+
+    def record(
+        self,
+        mode: str,
+        model: str,
+        client: str,
+        latency_ms: float,
+        prompt_tokens: int = 0,
+        completion_tokens: int = 0,
+        error: bool = False
+    ):
+        """Fold one finished request into every granularity"""
+        now = self._clock()
+        cost = estimate_cost(model, prompt_tokens, completion_tokens)
+        band = prompt_size_band(prompt_tokens)
+
+        for granularity in GRANULARITIES:
+            aggregates = self._bucket(granularity, now).aggregates
+            key = (mode, model, client, band)
+            aggregate = aggregates.get(key)
+            if aggregate is None:
+                if len(aggregates) >= self.max_keys:
+                    key = OVERFLOW_KEY
+                    aggregate = aggregates.get(key)
+                if aggregate is None:
+                    aggregate = aggregates[key] = _Aggregate(self.compression)
+
+            aggregate.requests += 1
+            aggregate.prompt_tokens += prompt_tokens
+            aggregate.completion_tokens += completion_tokens
+            aggregate.cost_usd += cost
+            aggregate.latency.add(latency_ms)
+            if error:
+                aggregate.errors += 1
+
+    def _buckets(self, granularity: str, window: Optional[int]) -> List[_Bucket]:
+        """Live buckets of a granularity, oldest first, limited to the last window buckets"""
+        size, slots = GRANULARITIES[granularity]
+        window = slots if window is None else min(window, slots)
+        oldest = int(self._clock() // size) * size - (window - 1) * size
+        buckets = [b for b in self._rings[granularity] if b is not None and b.start >= oldest]
+        return sorted(buckets, key=lambda b: b.start)
+
+    @staticmethod
+    def _group(aggregates: Iterable[Tuple[tuple, _Aggregate]], group_by: Tuple[str, ...], compression: int) -> Dict[tuple, _Aggregate]:
+        indexes = [DIMENSIONS.index(dimension) for dimension in group_by]
+        groups: Dict[tuple, _Aggregate] = {}
+        for key, aggregate in aggregates:
+            group_key = tuple(key[i] for i in indexes)
+            group = groups.get(group_key)
+            if group is None:
+                group = groups[group_key] = _Aggregate(compression)
+            group.merge(aggregate)
+        return groups
+
+    def _rows(self, groups: Dict[tuple, _Aggregate], group_by: Tuple[str, ...]) -> List[dict]:
+        rows = [
+            {**dict(zip(group_by, key)), **aggregate.to_dict()}
+            for key, aggregate in groups.items()
+        ]
+        return sorted(rows, key=lambda row: row["estimated_cost_usd"], reverse=True)
+
+    def breakdown(self, granularity: str, group_by: Tuple[str, ...], window: Optional[int] = None) -> dict:
+        """Totals over the last window buckets, grouped by the given dimensions"""
+        buckets = self._buckets(granularity, window)
+        aggregates = (item for bucket in buckets for item in bucket.aggregates.items())
+        groups = self._group(aggregates, group_by, self.compression)
+        return {
+            "granularity": granularity,
+            "group_by": list(group_by),
+            "from": buckets[0].start if buckets else None,
+            "rows": self._rows(groups, group_by)
+        }
+
+    def series(self, granularity: str, group_by: Tuple[str, ...], window: Optional[int] = None) -> dict:
+        """Per-bucket rollups over the last window buckets, grouped by the given dimensions"""
+        return {
+            "granularity": granularity,
+            "group_by": list(group_by),
+            "buckets": [
+                {
+                    "start": bucket.start,
+                    "rows": self._rows(
+                        self._group(bucket.aggregates.items(), group_by, self.compression), group_by
+                    )
+                }
+                for bucket in self._buckets(granularity, window)
+            ]
+        }
+
+    def get_memory_stats(self) -> dict:
+        """Get number of live buckets, aggregates and digest centroids (including buffered values)"""
+        buckets = [b for ring in self._rings.values() for b in ring if b is not None]
+        aggregates = [a for b in buckets for a in b.aggregates.values()]
+        return {
+            "buckets": len(buckets),
+            "aggregates": len(aggregates),
+            "max_aggregates": sum(slots for _, slots in GRANULARITIES.values()) * (self.max_keys + 1),
+            "centroids": sum(len(a.latency.means) + len(a.latency._buffer) for a in aggregates)
+        }
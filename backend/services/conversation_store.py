@@ -0,0 +1,80 @@
+"""
+Conversation Store Service
+Server-side conversation histories for one WebSocket connection, with caps
+"""
+from typing import Dict, List, NamedTuple, Optional
+from weakref import WeakSet
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class HistoryMessage(NamedTuple):
+    """Minimal message object accepted by ThinkingEngine.apply_thinking_style"""
+    role: str
+    content: str
+
+
+class ConversationStore:
+    """
+    Histories of the conversations multiplexed over one connection
+
+    At most max_conversations are open at once and each history keeps only
+    the last history_length messages, so per-connection memory is bounded.
+    """
+
+    # Live stores, for process-wide memory reporting
+    _instances: "WeakSet[ConversationStore]" = WeakSet()
+
+    def __init__(self, max_conversations: int, history_length: int = 10):
+        self.max_conversations = max_conversations
+        self.history_length = history_length
+        self._histories: Dict[int, List[HistoryMessage]] = {}
+        ConversationStore._instances.add(self)
+
+    def __contains__(self, conversation_id: int) -> bool:
+        return conversation_id in self._histories
+
+    def can_open(self, conversation_id: int) -> bool:
+        """Whether a message for this conversation may be accepted"""
+        return conversation_id in self._histories or len(self._histories) < self.max_conversations
+
+    def history(self, conversation_id: int, seed: Optional[List] = None) -> List[HistoryMessage]:
+        """History of a conversation, created from seed on first use"""
+        history = self._histories.get(conversation_id)
+        if history is None:
+            history = [HistoryMessage(m.role, m.content) for m in (seed or [])][-self.history_length:]
+            self._histories[conversation_id] = history
+        return history
+
+    def append_turn(self, conversation_id: int, user_message: str, answer: str):
+        """Add a finished turn; ignored if the conversation was ended meanwhile"""
+        history = self._histories.get(conversation_id)
+        if history is None:
+            return
+        history.append(HistoryMessage("user", user_message))
+        history.append(HistoryMessage("assistant", answer))
+        del history[:-self.history_length]
+
+    def end(self, conversation_id: int):
+        """Forget a conversation"""
+        self._histories.pop(conversation_id, None)
+
+    def get_memory_stats(self) -> dict:
+        """Get size of the stored histories"""
+        messages = [m for history in self._histories.values() for m in history]
+        return {
+            "conversations": len(self._histories),
+            "messages": len(messages),
+            "content_bytes": sum(len(m.content.encode("utf-8")) for m in messages)
+        }
+
+    @classmethod
+    def get_total_memory_stats(cls) -> dict:
+        """Get combined size of all live stores (one per open connection)"""
+        totals = {"connections": 0, "conversations": 0, "messages": 0, "content_bytes": 0}
+        for store in list(cls._instances):
+            totals["connections"] += 1
+            for key, value in store.get_memory_stats().items():
+                totals[key] += value
+        return totals
@@ -0,0 +1,78 @@
+"""
+Memory Monitoring Service
+Reports process RSS, per-structure sizes and tracemalloc allocation snapshots
+"""
+from typing import Optional
+import logging
+import os
+import resource
+import tracemalloc
+
+logger = logging.getLogger(__name__)
+
+# Frames kept per traced allocation; more frames cost more memory
+TRACEMALLOC_FRAMES = 1
+
+
+def start_tracing():
+    """Start tracemalloc allocation tracing (adds CPU and memory overhead)"""
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+        logger.info("tracemalloc tracing started")
+
+
+def get_rss_bytes() -> Optional[int]:
+    """Current resident set size, or None where /proc is unavailable"""
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def get_peak_rss_bytes() -> int:
+    """Peak resident set size (ru_maxrss is KiB on Linux)"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def get_tracemalloc_stats(limit: int = 10) -> dict:
+    """Top allocation sites by size from a tracemalloc snapshot"""
+    if not tracemalloc.is_tracing():
+        return {"enabled": False}
+
+    current, peak = tracemalloc.get_traced_memory()
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ))
+    top = [
+        {
+            "location": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+            "size_bytes": stat.size,
+            "count": stat.count
+        }
+        for stat in snapshot.statistics("lineno")[:limit]
+    ]
+    return {
+        "enabled": True,
+        "current_bytes": current,
+        "peak_bytes": peak,
+        "top": top
+    }
+
+
+def build_memory_report(structures: dict, limit: int = 10) -> dict:
+    """
+    Build a memory report for the process
+
+    Args:
+        structures: Mapping of structure name to its size stats
+        limit: Number of tracemalloc allocation sites to include
+    """
+    return {
+        "rss_bytes": get_rss_bytes(),
+        "peak_rss_bytes": get_peak_rss_bytes(),
+        "structures": structures,
+        "tracemalloc": get_tracemalloc_stats(limit)
+    }
@@ -4,7 +4,7 @@ Handles communication with OpenAI API for response generation
 With cost controls for free tier usage
 """
 from openai import AsyncOpenAI
-from typing import AsyncGenerator
+from typing import AsyncGenerator, Optional
 import logging
 
 from config import settings
@@ -23,8 +23,12 @@ class OpenAIClient:
     """
     
     def __init__(self):
-        self.client = AsyncOpenAI(api_key=settings.openai_api_key)
+        self.client = AsyncOpenAI(
+            api_key=settings.openai_api_key,
+            base_url=settings.openai_base_url or None
+        )
         self.model = settings.openai_model
+        self.in_flight = 0  # Number of upstream calls currently running
         logger.info(f"OpenAI client initialized with model: {self.model}")
         logger.info(f"Max tokens per response: {MAX_TOKENS_PER_RESPONSE}")
     
@@ -38,6 +42,7 @@ class OpenAIClient:
         Returns:
             Dictionary with 'content' and optional 'thinking_summary'
         """
+        self.in_flight += 1
         try:
             response = await self.client.chat.completions.create(
                 model=self.model,
@@ -68,17 +73,21 @@ class OpenAIClient:
         except Exception as e:
             logger.error(f"OpenAI API error: {str(e)}")
             raise
+        finally:
+            self.in_flight -= 1
     
-    async def get_response_stream(self, prompt_data: dict) -> AsyncGenerator[str, None]:
+    async def get_response_stream(self, prompt_data: dict, usage: Optional[dict] = None) -> AsyncGenerator[str, None]:
         """
         Get a streaming response from OpenAI
         
         Args:
             prompt_data: Dictionary containing 'messages' and 'mode'
+            usage: Optional dict filled with token usage once the stream completes
             
         Yields:
             Response chunks as strings
         """
+        self.in_flight += 1
         try:
             stream = await self.client.chat.completions.create(
                 model=self.model,
@@ -87,16 +96,26 @@ class OpenAIClient:
                 max_tokens=MAX_TOKENS_PER_RESPONSE,
                 presence_penalty=0.4,
                 frequency_penalty=0.2,
-                stream=True
+                stream=True,
+                stream_options={"include_usage": True}
             )
             
             async for chunk in stream:
-                if chunk.choices[0].delta.content:
+                # The final chunk carries usage and no choices
+                if chunk.usage and usage is not None:
+                    usage.update(
+                        prompt_tokens=chunk.usage.prompt_tokens,
+                        completion_tokens=chunk.usage.completion_tokens,
+                        total_tokens=chunk.usage.total_tokens
+                    )
+                if chunk.choices and chunk.choices[0].delta.content:
                     yield chunk.choices[0].delta.content
                     
         except Exception as e:
             logger.error(f"OpenAI streaming error: {str(e)}")
             raise
+        finally:
+            self.in_flight -= 1
     
     def _get_mode_summary(self, mode: str) -> str:
         """Get thinking process summary based on mode"""
@@ -0,0 +1,230 @@
+"""
+Speculative Follow-up Prefetch Service
+Precomputes answers to predictable follow-up questions while there is spare capacity
+"""
+from collections import OrderedDict
+from typing import Callable, List, NamedTuple, Optional
+import asyncio
+import hashlib
+import json
+import logging
+import time
+
+from config import settings
+from services.analytics import UsageAnalytics
+from services.conversation_store import HistoryMessage
+from services.usage_tracker import UsageTracker
+
+logger = logging.getLogger(__name__)
+
+# Follow-ups users commonly send right after an answer
+FOLLOW_UP_MESSAGES = [
+    "もっと具体的に",
+    "次に何をすべき？",
+]
+
+# Client label under which prefetch spend appears in usage analytics
+PREFETCH_CLIENT = "prefetch"
+
+# Trailing characters ignored when matching a follow-up against the cache
+_TRAILING_PUNCTUATION = "？?！!。. 　"
+
+
+class _CacheEntry(NamedTuple):
+    response: dict
+    tokens: int
+    expires_at: float
+
+
+class FollowUpPrefetcher:
+    """
+    Generates likely follow-up responses in the background and caches them
+
+    Prefetch only runs when enabled in settings, the upstream client is not
+    busy, and the daily token budget is below prefetch_token_budget_ratio.
+    """
+
+    def __init__(
+        self,
+        thinking_engine,
+        openai_client,
+        usage_tracker: UsageTracker,
+        analytics: Optional[UsageAnalytics] = None,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.thinking_engine = thinking_engine
+        self.openai_client = openai_client
+        self.usage_tracker = usage_tracker
+        self.analytics = analytics
+        self._clock = clock
+        self.enabled = settings.prefetch_enabled
+        self.max_entries = settings.prefetch_cache_size
+        self.ttl_seconds = settings.prefetch_ttl_seconds
+        self.max_inflight = settings.prefetch_max_inflight
+        self.budget_ratio = settings.prefetch_token_budget_ratio
+
+        self._cache: "OrderedDict[str, _CacheEntry]" = OrderedDict()
+        self._pending: set = set()
+        self._tasks: set = set()
+
+        self.lookups = 0
+        self.hits = 0
+        self.generated = 0
+        self.tokens_generated = 0
+        self.tokens_wasted = 0
+
+    @staticmethod
+    def _normalize(message: str) -> str:
+        return message.strip().rstrip(_TRAILING_PUNCTUATION)
+
+    def _cache_key(self, prompt_data: dict) -> str:
+        """Key on the exact prompt the follow-up request would send upstream"""
+        messages = [dict(m) for m in prompt_data["messages"]]
+        messages[-1]["content"] = self._normalize(messages[-1]["content"])
+        payload = json.dumps([prompt_data["mode"], messages], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _evict_expired(self):
+        """Drop expired entries, counting their tokens as wasted"""
+        now = self._clock()
+        expired = [key for key, entry in self._cache.items() if entry.expires_at <= now]
+        for key in expired:
+            self.tokens_wasted += self._cache.pop(key).tokens
+
+    def _has_capacity(self) -> bool:
+        if not self.enabled:
+            return False
+        if self.openai_client.in_flight >= self.max_inflight:
+            return False
+        if len(self._tasks) >= self.max_inflight:
+            return False
+        return self.usage_tracker.has_headroom(self.budget_ratio)
+
+    def lookup(self, prompt_data: dict) -> Optional[dict]:
+        """Return a cached response for this prompt, if one was prefetched"""
+        if not self.enabled:
+            return None
+
+        self._evict_expired()
+        self.lookups += 1
+        entry = self._cache.pop(self._cache_key(prompt_data), None)
+        if entry is None:
+            return None
+
+        self.hits += 1
+        logger.info(f"Prefetch hit ({self.hits}/{self.lookups} lookups)")
+        return entry.response
+
+    def schedule(self, user_message: str, answer: str, mode: str, history: Optional[List] = None):
+        """
+        Start background generation of likely follow-ups to a finished answer
+
+        Args:
+            user_message: The message that was just answered
+            answer: The assistant response that was returned
+            mode: The mode requested by the client
+            history: The conversation history sent with user_message
+        """
+        if not self._has_capacity():
+            return
+
+        next_history = [HistoryMessage(m.role, m.content) for m in (history or [])]
+        next_history.append(HistoryMessage("user", user_message))
+        next_history.append(HistoryMessage("assistant", answer))
+
+        for follow_up in FOLLOW_UP_MESSAGES:
+            # Each started task counts toward the cap, so re-check per follow-up
+            if len(self._tasks) >= self.max_inflight:
+                break
+
+            prompt_data = self.thinking_engine.apply_thinking_style(
+                user_message=follow_up,
+                mode=mode,
+                history=next_history
+            )
+            key = self._cache_key(prompt_data)
+            if key in self._cache or key in self._pending:
+                continue
+
+            self._pending.add(key)
+            task = asyncio.create_task(self._generate(key, prompt_data))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _generate(self, key: str, prompt_data: dict):
+        start = self._clock()
+        called_upstream = False
+        try:
+            # Re-check right before calling upstream; budget may have moved
+            if not self.usage_tracker.has_headroom(self.budget_ratio):
+                return
+
+            called_upstream = True
+            response = await asyncio.wait_for(
+                self.openai_client.get_response(prompt_data),
+                timeout=settings.max_response_time
+            )
+            usage = response.get("usage", {})
+            tokens = usage.get("total_tokens", 0)
+            self.usage_tracker.record_tokens(tokens)
+            self._record_analytics(prompt_data, start, usage)
+            self.generated += 1
+            self.tokens_generated += tokens
+
+            self._evict_expired()
+            self._cache[key] = _CacheEntry(
+                response=response,
+                tokens=tokens,
+                expires_at=self._clock() + self.ttl_seconds
+            )
+            while len(self._cache) > self.max_entries:
+                _, evicted = self._cache.popitem(last=False)
+                self.tokens_wasted += evicted.tokens
+
+        except Exception as e:
+            logger.warning(f"Prefetch failed: {str(e)}")
+            if called_upstream:
+                self._record_analytics(prompt_data, start, error=True)
+        finally:
+            self._pending.discard(key)
+
+    def _record_analytics(self, prompt_data: dict, start: float, usage: Optional[dict] = None, error: bool = False):
+        """Attribute prefetch spend to its own client so wasted tokens show up in breakdowns"""
+        if self.analytics is None:
+            return
+        usage = usage or {}
+        self.analytics.record(
+            mode=prompt_data["mode"],
+            model=self.openai_client.model,
+            client=PREFETCH_CLIENT,
+            latency_ms=(self._clock() - start) * 1000,
+            prompt_tokens=usage.get("prompt_tokens", 0),
+            completion_tokens=usage.get("completion_tokens", 0),
+            error=error
+        )
+
+    def get_memory_stats(self) -> dict:
+        """Get size of the prefetch cache"""
+        return {
+            "entries": len(self._cache),
+            "max_entries": self.max_entries,
+            "content_bytes": sum(len(e.response["content"].encode("utf-8")) for e in self._cache.values()),
+            "pending_tasks": len(self._tasks)
+        }
+
+    def get_stats(self) -> dict:
+        """Get hit rate and wasted-token statistics for tuning"""
+        self._evict_expired()
+        return {
+            "enabled": self.enabled,
+            "cached_entries": len(self._cache),
+            "in_progress": len(self._pending),
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "generated": self.generated,
+            "hit_rate": round(self.hits / self.lookups, 4) if self.lookups else 0.0,
+            "prefetch_precision": round(self.hits / self.generated, 4) if self.generated else 0.0,
+            "tokens_generated": self.tokens_generated,
+            "tokens_wasted": self.tokens_wasted,
+            "wasted_token_ratio": round(self.tokens_wasted / self.tokens_generated, 4) if self.tokens_generated else 0.0
+        }
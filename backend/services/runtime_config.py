@@ -0,0 +1,167 @@
+"""
+Runtime Configuration Service
+Hot-reloads persona prompts, mode keywords and usage limits from a versioned JSON file
+
+File format (every section and key is optional; omitted values keep the built-in defaults):
+    {
+        "version": "2026-10-18.1",
+        "persona": {
+            "base_system_prompt": "...",
+            "mode_additions": {"first_principles": "...", "strategy": "...", "life": "..."},
+            "mode_keywords": {"first_principles": ["なぜ", ...], ...}
+        },
+        "limits": {"max_requests_per_minute": 10, "max_tokens_per_day": 50000, ...}
+    }
+"""
+from typing import NamedTuple, Optional
+import asyncio
+import hashlib
+import json
+import logging
+import os
+
+from config import settings
+from services.thinking_engine import PersonaConfig, ThinkingEngine
+from services.usage_tracker import UsageLimits, UsageTracker
+
+logger = logging.getLogger(__name__)
+
+
+class RuntimeConfig(NamedTuple):
+    """A fully built configuration version, ready to swap in"""
+    version: str
+    persona: PersonaConfig
+    limits: UsageLimits
+
+
+def load_runtime_config(path: str, max_records: Optional[int] = None) -> RuntimeConfig:
+    """
+    Read and precompile a runtime config file
+    Raises ValueError/OSError on invalid input so the current config stays active
+
+    max_records is the usage tracker's record cap (defaults to usage_max_records);
+    a max_requests_per_day above it is rejected rather than growing the cap.
+    """
+    with open(path, "rb") as f:
+        raw = f.read()
+
+    data = json.loads(raw)
+    if not isinstance(data, dict):
+        raise ValueError("Runtime config must be a JSON object")
+
+    version = str(data.get("version") or hashlib.sha256(raw).hexdigest()[:12])
+
+    persona_data = data.get("persona", {})
+    if not isinstance(persona_data, dict):
+        raise ValueError("persona must be a JSON object")
+
+    base_system_prompt = persona_data.get("base_system_prompt")
+    if base_system_prompt is not None and not isinstance(base_system_prompt, str):
+        raise ValueError("persona.base_system_prompt must be a string")
+
+    mode_additions = persona_data.get("mode_additions")
+    if mode_additions is not None and not (
+        isinstance(mode_additions, dict) and all(isinstance(v, str) for v in mode_additions.values())
+    ):
+        raise ValueError("persona.mode_additions must map modes to strings")
+
+    mode_keywords = persona_data.get("mode_keywords")
+    if mode_keywords is not None and not (
+        isinstance(mode_keywords, dict)
+        and all(
+            isinstance(words, list) and all(isinstance(word, str) and word for word in words)
+            for words in mode_keywords.values()
+        )
+    ):
+        raise ValueError("persona.mode_keywords must map modes to lists of non-empty strings")
+
+    persona = ThinkingEngine.build_persona(
+        version=version,
+        base_system_prompt=base_system_prompt,
+        mode_additions=mode_additions,
+        mode_keywords=mode_keywords
+    )
+
+    limits_data = data.get("limits", {})
+    if not isinstance(limits_data, dict):
+        raise ValueError("limits must be a JSON object")
+    unknown = set(limits_data) - set(UsageLimits._fields)
+    if unknown:
+        raise ValueError(f"Unknown limits: {', '.join(sorted(unknown))}")
+    values = {key: int(value) for key, value in limits_data.items()}
+    too_small = sorted(key for key, value in values.items() if value < 1)
+    if too_small:
+        raise ValueError(f"Limits must be at least 1: {', '.join(too_small)}")
+    limits = UsageTracker.default_limits()._replace(**values)
+    max_records = settings.usage_max_records if max_records is None else max_records
+    if limits.max_requests_per_day > max_records:
+        raise ValueError(
+            f"limits.max_requests_per_day ({limits.max_requests_per_day}) exceeds USAGE_MAX_RECORDS ({max_records})"
+        )
+
+    return RuntimeConfig(version=version, persona=persona, limits=limits)
+
+
+class RuntimeConfigWatcher:
+    """
+    Polls a runtime config file and applies new versions without a restart
+
+    Parsing and prompt/keyword precompilation run in a worker thread; the
+    result is applied with single reference swaps, so request handlers never
+    lock or observe a partially applied config.
+    """
+
+    def __init__(self, path: str, poll_seconds: float, engine: ThinkingEngine, tracker: UsageTracker):
+        self.path = path
+        self.poll_seconds = poll_seconds
+        self.engine = engine
+        self.tracker = tracker
+        self.version = engine.persona.version
+        self._mtime: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def check_once(self) -> bool:
+        """Reload if the file changed; returns True when a new version was applied"""
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            return False
+        if mtime == self._mtime:
+            return False
+        self._mtime = mtime
+
+        try:
+            config = await asyncio.to_thread(load_runtime_config, self.path, self.tracker.max_records)
+        except (OSError, ValueError, TypeError, AttributeError) as e:
+            logger.error(f"Runtime config rejected, keeping version {self.version}: {str(e)}")
+            return False
+
+        if config.version == self.version:
+            logger.info(f"Runtime config changed but version {self.version} is unchanged; not applied")
+            return False
+
+        self.engine.apply_persona(config.persona)
+        self.tracker.apply_limits(config.limits)
+        self.version = config.version
+        logger.info(f"Runtime config version {config.version} applied")
+        return True
+
+    async def _run(self):
+        while True:
+            await self.check_once()
+            await asyncio.sleep(self.poll_seconds)
+
+    def start(self):
+        """Start background polling on the running event loop"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"Watching runtime config: {self.path}")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -2,13 +2,25 @@
 Thinking Engine Service with Authentic Elon Musk Personality
 Based on extensive research of his interviews, tweets, and public statements
 """
-from typing import List, Optional
+from types import MappingProxyType
+from typing import List, Mapping, NamedTuple, Optional, Tuple
 import logging
 import re
 
 logger = logging.getLogger(__name__)
 
 
+class PersonaConfig(NamedTuple):
+    """
+    Immutable, precompiled persona snapshot
+    Swapped as a whole on reload so readers never see a half-applied change
+    """
+    version: str
+    system_prompts: Mapping[str, str]  # mode -> full system prompt
+    base_system_prompt: str
+    mode_keywords: Tuple[Tuple[str, Tuple[str, ...]], ...]  # ordered for tie-breaking
+
+
 class ThinkingEngine:
     """
     Core engine that channels Elon Musk's authentic communication style.
@@ -187,27 +199,58 @@ SpaceXを始めたとき、みんな「ロケットは65億ドルかかる」と
 
 人生で後悔するのは、やったことじゃない。やらなかったことだ。"""
 
-    def detect_mode(self, message: str) -> str:
+    def __init__(self, persona: Optional[PersonaConfig] = None):
+        self.persona = persona or self.build_persona()
+    
+    @classmethod
+    def build_persona(
+        cls,
+        version: str = "builtin",
+        base_system_prompt: Optional[str] = None,
+        mode_additions: Optional[dict] = None,
+        mode_keywords: Optional[dict] = None
+    ) -> PersonaConfig:
+        """
+        Precompile a persona snapshot; omitted parts fall back to the class defaults
+        Full per-mode system prompts are concatenated once here, not per request
+        """
+        base = cls.BASE_SYSTEM_PROMPT if base_system_prompt is None else base_system_prompt
+        additions = {
+            "first_principles": cls.FIRST_PRINCIPLES_ADDITION,
+            "strategy": cls.STRATEGY_ADDITION,
+            "life": cls.LIFE_ADDITION
+        }
+        additions.update(mode_additions or {})
+        keywords = cls.MODE_KEYWORDS if mode_keywords is None else mode_keywords
+        
+        return PersonaConfig(
+            version=version,
+            system_prompts=MappingProxyType({mode: base + text for mode, text in additions.items()}),
+            base_system_prompt=base,
+            # detect_mode lowercases the message, so keywords are matched in lowercase too
+            mode_keywords=tuple((mode, tuple(word.lower() for word in words)) for mode, words in keywords.items())
+        )
+    
+    def apply_persona(self, persona: PersonaConfig):
+        """Swap in a new persona snapshot (single reference assignment, no locking)"""
+        self.persona = persona
+        logger.info(f"Persona config updated to version {persona.version}")
+    
+    def detect_mode(self, message: str, persona: Optional[PersonaConfig] = None) -> str:
         """Automatically detect the most appropriate thinking mode"""
+        persona = persona or self.persona
         message_lower = message.lower()
         
-        scores = {mode: 0 for mode in self.MODE_KEYWORDS}
-        
-        for mode, keywords in self.MODE_KEYWORDS.items():
-            for keyword in keywords:
-                if keyword in message_lower:
-                    scores[mode] += 1
+        best_mode = "standard"
+        max_score = 0
         
-        max_score = max(scores.values())
+        for mode, keywords in persona.mode_keywords:
+            score = sum(1 for keyword in keywords if keyword in message_lower)
+            if score > max_score:
+                best_mode = mode
+                max_score = score
         
-        if max_score == 0:
-            return "standard"
-        
-        for mode, score in scores.items():
-            if score == max_score:
-                return mode
-        
-        return "standard"
+        return best_mode
 
     def apply_thinking_style(
         self,
@@ -216,20 +259,14 @@ SpaceXを始めたとき、みんな「ロケットは65億ドルかかる」と
         history: Optional[List] = None
     ) -> dict:
         """Apply Elon Musk persona with appropriate thinking style"""
+        persona = self.persona
         
         if mode == "auto" or mode == "standard":
-            detected_mode = self.detect_mode(user_message)
+            detected_mode = self.detect_mode(user_message, persona)
         else:
             detected_mode = mode
         
-        system_prompt = self.BASE_SYSTEM_PROMPT
-        
-        if detected_mode == "first_principles":
-            system_prompt += self.FIRST_PRINCIPLES_ADDITION
-        elif detected_mode == "strategy":
-            system_prompt += self.STRATEGY_ADDITION
-        elif detected_mode == "life":
-            system_prompt += self.LIFE_ADDITION
+        system_prompt = persona.system_prompts.get(detected_mode, persona.base_system_prompt)
         
         logger.info(f"Applied mode: {detected_mode}")
         
@@ -246,7 +283,8 @@ SpaceXを始めたとき、みんな「ロケットは65億ドルかかる」と
         
         return {
             "messages": messages,
-            "mode": detected_mode
+            "mode": detected_mode,
+            "config_version": persona.version
         }
     
     def get_thinking_summary(self, mode: str) -> str:
@@ -2,13 +2,31 @@
 Rate Limiting and Usage Control Service
 Prevents excessive API calls and monitors token usage
 """
-from datetime import datetime, timedelta
-from collections import defaultdict
-from typing import Optional
+from datetime import datetime
+from array import array
+from bisect import bisect_right
+from typing import Callable, NamedTuple, Optional
 import logging
+import time
+
+from config import settings
 
 logger = logging.getLogger(__name__)
 
+# Sliding windows in seconds
+MINUTE = 60
+HOUR = 60 * 60
+DAY = 24 * 60 * 60
+
+
+class UsageLimits(NamedTuple):
+    """Immutable snapshot of usage limits; swapped as a whole on reload"""
+    max_requests_per_minute: int
+    max_requests_per_hour: int
+    max_requests_per_day: int
+    max_tokens_per_request: int
+    max_tokens_per_day: int
+
 
 class UsageTracker:
     """
@@ -17,6 +35,9 @@ class UsageTracker:
     OpenAI Free Tier Limits (approximate):
     - GPT-4o-mini: ~200 RPM, ~200K TPM
     - Daily budget recommendation: Stay under $5/day
+    
+    Request records are kept as two parallel arrays (timestamps and tokens,
+    16 bytes per request) in time order, so window counts are binary searches.
     """
     
     # Conservative limits to stay well within free tier
@@ -26,87 +47,141 @@ class UsageTracker:
     MAX_TOKENS_PER_REQUEST = 1000  # Limit response length
     MAX_TOKENS_PER_DAY = 50000
     
-    def __init__(self):
-        self.requests: list = []
+    # Hard cap on stored records (usage_max_records); the daily limit normally keeps it far lower
+    MAX_RECORDS = 10000
+    
+    def __init__(self, max_records: Optional[int] = None, clock: Callable[[], float] = time.time):
+        self.limits = self.default_limits()
+        self.timestamps = array("d")
+        self.tokens = array("l")
+        self.max_records = max(max_records or self.MAX_RECORDS, self.MAX_REQUESTS_PER_DAY)
         self.daily_tokens: int = 0
-        self.last_reset: datetime = datetime.now()
-        self._cleanup_interval = timedelta(hours=1)
+        self._clock = clock
+        self.last_reset: datetime = datetime.fromtimestamp(clock())
+    
+    @classmethod
+    def default_limits(cls) -> UsageLimits:
+        """Built-in limits from the class constants"""
+        return UsageLimits(
+            max_requests_per_minute=cls.MAX_REQUESTS_PER_MINUTE,
+            max_requests_per_hour=cls.MAX_REQUESTS_PER_HOUR,
+            max_requests_per_day=cls.MAX_REQUESTS_PER_DAY,
+            max_tokens_per_request=cls.MAX_TOKENS_PER_REQUEST,
+            max_tokens_per_day=cls.MAX_TOKENS_PER_DAY
+        )
+    
+    def apply_limits(self, limits: UsageLimits):
+        """Swap in a new limits snapshot (single reference assignment, no locking)"""
+        if limits.max_requests_per_day > self.max_records:
+            raise ValueError(
+                f"max_requests_per_day ({limits.max_requests_per_day}) exceeds the record cap ({self.max_records})"
+            )
+        self.limits = limits
+        logger.info(f"Usage limits updated: {limits._asdict()}")
     
     def _cleanup_old_requests(self):
         """Remove requests older than 24 hours"""
-        cutoff = datetime.now() - timedelta(hours=24)
-        self.requests = [r for r in self.requests if r["timestamp"] > cutoff]
+        now = self._clock()
+        stale = bisect_right(self.timestamps, now - DAY)
+        if stale:
+            del self.timestamps[:stale]
+            del self.tokens[:stale]
         
         # Reset daily token counter at midnight
-        if datetime.now().date() > self.last_reset.date():
+        today = datetime.fromtimestamp(now)
+        if today.date() > self.last_reset.date():
             self.daily_tokens = 0
-            self.last_reset = datetime.now()
+            self.last_reset = today
             logger.info("Daily token counter reset")
     
+    def _count_since(self, cutoff: float) -> int:
+        """Number of recorded requests newer than cutoff"""
+        return len(self.timestamps) - bisect_right(self.timestamps, cutoff)
+    
     def can_make_request(self) -> tuple[bool, Optional[str]]:
         """
         Check if a new request is allowed
         Returns: (allowed, reason if blocked)
         """
         self._cleanup_old_requests()
-        now = datetime.now()
+        now = self._clock()
+        limits = self.limits
         
         # Check per-minute limit
-        minute_ago = now - timedelta(minutes=1)
-        recent_minute = sum(1 for r in self.requests if r["timestamp"] > minute_ago)
-        if recent_minute >= self.MAX_REQUESTS_PER_MINUTE:
-            wait_time = 60 - (now - self.requests[-1]["timestamp"]).seconds
-            return False, f"レート制限: 1分あたり{self.MAX_REQUESTS_PER_MINUTE}回まで。{wait_time}秒後に再試行してください。"
+        recent_minute = self._count_since(now - MINUTE)
+        if recent_minute >= limits.max_requests_per_minute:
+            wait_time = 60 - int(now - self.timestamps[-1]) if self.timestamps else 60
+            return False, f"レート制限: 1分あたり{limits.max_requests_per_minute}回まで。{wait_time}秒後に再試行してください。"
         
         # Check per-hour limit
-        hour_ago = now - timedelta(hours=1)
-        recent_hour = sum(1 for r in self.requests if r["timestamp"] > hour_ago)
-        if recent_hour >= self.MAX_REQUESTS_PER_HOUR:
-            return False, f"レート制限: 1時間あたり{self.MAX_REQUESTS_PER_HOUR}回まで。しばらくお待ちください。"
+        recent_hour = self._count_since(now - HOUR)
+        if recent_hour >= limits.max_requests_per_hour:
+            return False, f"レート制限: 1時間あたり{limits.max_requests_per_hour}回まで。しばらくお待ちください。"
         
         # Check daily limit
-        day_ago = now - timedelta(hours=24)
-        recent_day = sum(1 for r in self.requests if r["timestamp"] > day_ago)
-        if recent_day >= self.MAX_REQUESTS_PER_DAY:
-            return False, f"1日の上限（{self.MAX_REQUESTS_PER_DAY}回）に達しました。明日再試行してください。"
+        recent_day = self._count_since(now - DAY)
+        if recent_day >= limits.max_requests_per_day:
+            return False, f"1日の上限（{limits.max_requests_per_day}回）に達しました。明日再試行してください。"
         
         # Check daily token limit
-        if self.daily_tokens >= self.MAX_TOKENS_PER_DAY:
-            return False, f"1日のトークン上限（{self.MAX_TOKENS_PER_DAY}）に達しました。"
+        if self.daily_tokens >= limits.max_tokens_per_day:
+            return False, f"1日のトークン上限（{limits.max_tokens_per_day}）に達しました。"
         
         return True, None
     
     def record_request(self, tokens_used: int = 0):
         """Record a successful request"""
-        self.requests.append({
-            "timestamp": datetime.now(),
-            "tokens": tokens_used
-        })
+        self.timestamps.append(self._clock())
+        self.tokens.append(tokens_used)
+        overflow = len(self.timestamps) - self.max_records
+        if overflow > 0:
+            del self.timestamps[:overflow]
+            del self.tokens[:overflow]
         self.daily_tokens += tokens_used
-        logger.info(f"Request recorded. Daily tokens: {self.daily_tokens}/{self.MAX_TOKENS_PER_DAY}")
+        logger.info(f"Request recorded. Daily tokens: {self.daily_tokens}/{self.limits.max_tokens_per_day}")
+    
+    def record_tokens(self, tokens_used: int):
+        """Record tokens without counting a request (e.g. prefetch, or a stream after admission)"""
+        self.daily_tokens += tokens_used
+        logger.info(f"Tokens recorded. Daily tokens: {self.daily_tokens}/{self.limits.max_tokens_per_day}")
+    
+    def has_headroom(self, budget_ratio: float) -> bool:
+        """
+        Check whether optional background work may spend tokens
+        Returns False once daily tokens exceed budget_ratio of the limit
+        """
+        allowed, _ = self.can_make_request()
+        if not allowed:
+            return False
+        return self.daily_tokens < self.limits.max_tokens_per_day * budget_ratio
     
     def get_usage_stats(self) -> dict:
         """Get current usage statistics"""
         self._cleanup_old_requests()
-        now = datetime.now()
-        
-        minute_ago = now - timedelta(minutes=1)
-        hour_ago = now - timedelta(hours=1)
-        day_ago = now - timedelta(hours=24)
+        now = self._clock()
+        limits = self.limits
         
         return {
-            "requests_last_minute": sum(1 for r in self.requests if r["timestamp"] > minute_ago),
-            "requests_last_hour": sum(1 for r in self.requests if r["timestamp"] > hour_ago),
-            "requests_last_24h": sum(1 for r in self.requests if r["timestamp"] > day_ago),
+            "requests_last_minute": self._count_since(now - MINUTE),
+            "requests_last_hour": self._count_since(now - HOUR),
+            "requests_last_24h": self._count_since(now - DAY),
             "tokens_today": self.daily_tokens,
             "limits": {
-                "per_minute": self.MAX_REQUESTS_PER_MINUTE,
-                "per_hour": self.MAX_REQUESTS_PER_HOUR,
-                "per_day": self.MAX_REQUESTS_PER_DAY,
-                "tokens_per_day": self.MAX_TOKENS_PER_DAY
+                "per_minute": limits.max_requests_per_minute,
+                "per_hour": limits.max_requests_per_hour,
+                "per_day": limits.max_requests_per_day,
+                "tokens_per_day": limits.max_tokens_per_day
             }
         }
+    
+    def get_memory_stats(self) -> dict:
+        """Get size of the in-process request records"""
+        return {
+            "records": len(self.timestamps),
+            "max_records": self.max_records,
+            "bytes": (self.timestamps.itemsize + self.tokens.itemsize) * len(self.timestamps)
+        }
 
 
 # Global singleton instance
-usage_tracker = UsageTracker()
+usage_tracker = UsageTracker(max_records=settings.usage_max_records)
@@ -0,0 +1,84 @@
+"""
+Fake OpenAI-Compatible Upstream
+Local stand-in for the chat completions API, used for end-to-end latency replay
+
+Usage (from backend/):
+    FAKE_UPSTREAM_DELAY_MS=800 uvicorn tools.fake_upstream:app --port 9000
+    OPENAI_BASE_URL=http://localhost:9000/v1 OPENAI_API_KEY=fake \
+        RUNTIME_CONFIG_PATH=tools/replay_limits.json uvicorn main:app --port 8000
+    python -m tools.replay corpus.jsonl --endpoint http://localhost:8000/api/chat
+"""
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+import asyncio
+import json
+import os
+import time
+
+# Simulated upstream latency and completion length
+DELAY_MS = int(os.getenv("FAKE_UPSTREAM_DELAY_MS", "500"))
+COMPLETION_TOKENS = int(os.getenv("FAKE_UPSTREAM_COMPLETION_TOKENS", "400"))
+
+FAKE_CONTENT = "やるしかない。"
+
+app = FastAPI(title="Fake OpenAI Upstream")
+
+
+def _prompt_tokens(messages: list) -> int:
+    """Cheap size estimate; exact counts are not needed for latency replay"""
+    return sum(len(m.get("content", "")) for m in messages)
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    model = body.get("model", "gpt-4o-mini")
+    prompt_tokens = _prompt_tokens(body.get("messages", []))
+    created = int(time.time())
+    usage = {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": COMPLETION_TOKENS,
+        "total_tokens": prompt_tokens + COMPLETION_TOKENS
+    }
+
+    if body.get("stream"):
+        async def generate():
+            pieces = 10
+            for _ in range(pieces):
+                await asyncio.sleep(DELAY_MS / 1000 / pieces)
+                chunk = {
+                    "id": "chatcmpl-fake",
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": model,
+                    "choices": [{"index": 0, "delta": {"content": FAKE_CONTENT}, "finish_reason": None}]
+                }
+                yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+            if (body.get("stream_options") or {}).get("include_usage"):
+                # Same shape as the API: a final chunk with usage and no choices
+                chunk = {
+                    "id": "chatcmpl-fake",
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": model,
+                    "choices": [],
+                    "usage": usage
+                }
+                yield f"data: {json.dumps(chunk)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(generate(), media_type="text/event-stream")
+
+    await asyncio.sleep(DELAY_MS / 1000)
+    return {
+        "id": "chatcmpl-fake",
+        "object": "chat.completion",
+        "created": created,
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": FAKE_CONTENT * 10},
+            "finish_reason": "stop"
+        }],
+        "usage": usage
+    }
@@ -0,0 +1,295 @@
+"""
+Offline Replay Harness
+Replays a corpus of recorded chat requests to measure prompt size, mode routing and cost
+
+Usage (from backend/):
+    python -m tools.replay corpus.jsonl --save-baseline baseline.json
+    # ...edit BASE_SYSTEM_PROMPT / MODE_KEYWORDS / mode additions...
+    python -m tools.replay corpus.jsonl --baseline baseline.json
+
+    # Or test a runtime config (RUNTIME_CONFIG_PATH JSON) before it goes live
+    python -m tools.replay corpus.jsonl --baseline baseline.json --config persona.json
+
+    # End-to-end latency against a running backend (e.g. pointed at tools.fake_upstream).
+    # Start it with RUNTIME_CONFIG_PATH=tools/replay_limits.json, otherwise the default
+    # rate limits turn most of the corpus into 429s and the run exits with status 2.
+    python -m tools.replay corpus.jsonl --endpoint http://localhost:8000/api/chat
+
+Each corpus line is a ChatRequest payload:
+    {"message": "...", "mode": "auto", "conversation_history": [{"role": "user", "content": "..."}]}
+Lines without "message" fall back to "body" so backlog-style JSONL files can be replayed too.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from collections import Counter
+from functools import partial
+from types import SimpleNamespace
+from typing import List, Optional
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+from services.analytics import DEFAULT_MODEL, estimate_cost
+from services.runtime_config import load_runtime_config
+from services.thinking_engine import ThinkingEngine
+
+# Assumed completion size per request; matches MAX_TOKENS_PER_RESPONSE in openai_client
+DEFAULT_COMPLETION_TOKENS = 800
+
+# Per-message overhead of the chat completions format
+TOKENS_PER_MESSAGE = 3
+
+
+def _load_encoder():
+    """Use tiktoken when installed, otherwise fall back to a character estimate"""
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    return tiktoken.get_encoding("o200k_base")
+
+
+def count_tokens(text: str, encoder=None) -> int:
+    if encoder is not None:
+        return len(encoder.encode(text))
+    # Rough estimate: ~1 token per CJK character, ~4 ASCII characters per token
+    ascii_chars = sum(1 for c in text if ord(c) < 128)
+    return (len(text) - ascii_chars) + (ascii_chars + 3) // 4
+
+
+def _check_record(record) -> Optional[str]:
+    """Reason a corpus record cannot be replayed, or None if it is valid"""
+    if not isinstance(record, dict):
+        return "record must be a JSON object"
+    if not isinstance(record.get("mode", "auto"), str):
+        return "mode must be a string"
+    history = record.get("conversation_history") or []
+    if not isinstance(history, list) or not all(
+        isinstance(m, dict) and isinstance(m.get("role"), str) and isinstance(m.get("content"), str)
+        for m in history
+    ):
+        return "conversation_history must be a list of {role, content} objects"
+    return None
+
+
+def load_corpus(path: str) -> List[dict]:
+    """
+    Load recorded requests from a JSONL file
+    Raises ValueError naming the line of the first record that cannot be replayed
+    """
+    corpus = []
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"{path}:{line_number}: invalid JSON: {str(e)}")
+            problem = _check_record(record)
+            if problem:
+                raise ValueError(f"{path}:{line_number}: {problem}")
+            message = record.get("message") or record.get("body")
+            if not message:
+                continue
+            if not isinstance(message, str):
+                raise ValueError(f"{path}:{line_number}: message must be a string")
+            corpus.append({
+                "message": message,
+                "mode": record.get("mode", "auto"),
+                "conversation_history": [
+                    {"role": m["role"], "content": m["content"]}
+                    for m in record.get("conversation_history") or []
+                ]
+            })
+    return corpus
+
+
+def _build_engine(config_path: Optional[str] = None) -> ThinkingEngine:
+    """Engine with the built-in persona, or the persona from a runtime config file"""
+    if config_path is None:
+        return ThinkingEngine()
+    return ThinkingEngine(load_runtime_config(config_path).persona)
+
+
+def _replay_chunk(records: List[dict], config_path: Optional[str] = None) -> List[dict]:
+    """Run a chunk of records through the thinking engine (executed in a worker process)"""
+    # Persona snapshots are not picklable, so each worker loads the config itself
+    engine = _build_engine(config_path)
+    encoder = _load_encoder()
+    results = []
+    for record in records:
+        history = [SimpleNamespace(**m) for m in record["conversation_history"]]
+        prompt_data = engine.apply_thinking_style(
+            user_message=record["message"],
+            mode=record["mode"],
+            history=history
+        )
+        prompt_tokens = sum(
+            count_tokens(m["content"], encoder) + TOKENS_PER_MESSAGE
+            for m in prompt_data["messages"]
+        )
+        results.append({"mode": prompt_data["mode"], "prompt_tokens": prompt_tokens})
+    return results
+
+
+def replay_offline(
+    corpus: List[dict],
+    workers: int,
+    completion_tokens: int,
+    model: str = DEFAULT_MODEL,
+    config_path: Optional[str] = None
+) -> dict:
+    """Replay the corpus through apply_thinking_style in parallel and summarize"""
+    # Load once up front so an invalid config fails before workers start
+    config_version = _build_engine(config_path).persona.version
+    chunk_size = max(1, len(corpus) // (workers * 4))
+    chunks = [corpus[i:i + chunk_size] for i in range(0, len(corpus), chunk_size)]
+
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for chunk_results in executor.map(partial(_replay_chunk, config_path=config_path), chunks):
+            results.extend(chunk_results)
+
+    prompt_tokens = [r["prompt_tokens"] for r in results]
+    total_prompt = sum(prompt_tokens)
+    total_completion = completion_tokens * len(results)
+    cost = estimate_cost(model, total_prompt, total_completion)
+
+    return {
+        "requests": len(results),
+        "config_version": config_version,
+        "prompt_tokens_total": total_prompt,
+        "prompt_tokens_mean": round(total_prompt / len(results), 1) if results else 0.0,
+        "prompt_tokens_max": max(prompt_tokens, default=0),
+        "mode_distribution": dict(Counter(r["mode"] for r in results)),
+        "estimated_cost_usd": round(cost, 6),
+        "tokenizer": "tiktoken" if _load_encoder() else "estimate"
+    }
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def replay_endpoint(corpus: List[dict], endpoint: str, concurrency: int) -> dict:
+    """Send the corpus to a running backend and measure end-to-end latency"""
+    import httpx
+
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    statuses: Counter = Counter()
+
+    async def send(client, record):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                response = await client.post(endpoint, json=record)
+                statuses[str(response.status_code)] += 1
+                if response.status_code == 200:
+                    latencies.append((time.perf_counter() - start) * 1000)
+            except httpx.HTTPError as e:
+                statuses[type(e).__name__] += 1
+
+    async with httpx.AsyncClient(timeout=120.0) as client:
+        await asyncio.gather(*(send(client, record) for record in corpus))
+
+    # Latency from a partly rejected run only describes the requests that got through
+    failed = len(corpus) - statuses["200"]
+    return {
+        "status_counts": dict(statuses),
+        "rate_limited_share": round(statuses["429"] / len(corpus), 4) if corpus else 0.0,
+        "latency_valid": failed == 0,
+        "latency_ms_p50": round(_percentile(latencies, 50), 1),
+        "latency_ms_p95": round(_percentile(latencies, 95), 1),
+        "latency_ms_max": round(max(latencies, default=0.0), 1)
+    }
+
+
+def diff_reports(baseline: dict, current: dict) -> dict:
+    """Compute numeric and mode-distribution differences against a baseline report"""
+    diff = {}
+    for key, value in current.items():
+        base_value = baseline.get(key)
+        if isinstance(value, (int, float)) and isinstance(base_value, (int, float)):
+            delta = value - base_value
+            diff[key] = {
+                "baseline": base_value,
+                "current": value,
+                "delta": round(delta, 6),
+                "delta_pct": round(delta / base_value * 100, 2) if base_value else None
+            }
+    modes = set(baseline.get("mode_distribution", {})) | set(current.get("mode_distribution", {}))
+    diff["mode_distribution"] = {
+        mode: {
+            "baseline": baseline.get("mode_distribution", {}).get(mode, 0),
+            "current": current.get("mode_distribution", {}).get(mode, 0)
+        }
+        for mode in sorted(modes)
+    }
+    return diff
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Replay recorded chat requests against prompt changes")
+    parser.add_argument("corpus", help="JSONL file of recorded ChatRequest payloads")
+    parser.add_argument("--baseline", help="Baseline report JSON to diff against")
+    parser.add_argument("--save-baseline", help="Write the current report to this path")
+    parser.add_argument("--workers", type=int, default=4, help="Worker processes for offline replay")
+    parser.add_argument("--completion-tokens", type=int, default=DEFAULT_COMPLETION_TOKENS,
+                        help="Assumed completion tokens per request for cost estimates")
+    parser.add_argument("--model", default=DEFAULT_MODEL, help="Model whose prices are used for cost estimates")
+    parser.add_argument("--config", help="Runtime config JSON whose persona is replayed instead of the built-in one")
+    parser.add_argument("--endpoint", help="Backend /api/chat URL for end-to-end latency replay")
+    parser.add_argument("--concurrency", type=int, default=4, help="Concurrent requests for --endpoint")
+    args = parser.parse_args(argv)
+
+    try:
+        corpus = load_corpus(args.corpus)
+    except (OSError, ValueError) as e:
+        print(f"Invalid corpus: {str(e)}", file=sys.stderr)
+        return 1
+    if not corpus:
+        print(f"No requests found in {args.corpus}", file=sys.stderr)
+        return 1
+
+    if args.config:
+        try:
+            load_runtime_config(args.config)
+        except (OSError, ValueError, TypeError, AttributeError) as e:
+            print(f"Invalid runtime config {args.config}: {str(e)}", file=sys.stderr)
+            return 1
+
+    report = replay_offline(corpus, args.workers, args.completion_tokens, args.model, args.config)
+    if args.endpoint:
+        report.update(asyncio.run(replay_endpoint(corpus, args.endpoint, args.concurrency)))
+
+    output = {"report": report}
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        output["diff"] = diff_reports(baseline, report)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    print(json.dumps(output, ensure_ascii=False, indent=2))
+    if args.endpoint and not report["latency_valid"]:
+        print(
+            f"{len(corpus) - report['status_counts'].get('200', 0)} of {len(corpus)} requests did not return 200; "
+            "latency figures are not valid (start the backend with RUNTIME_CONFIG_PATH=tools/replay_limits.json)",
+            file=sys.stderr
+        )
+        return 2
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,189 @@
+"""
+Memory Soak Benchmark
+Simulates days of traffic against the in-process state and samples RSS every simulated hour
+
+Usage (from backend/):
+    python -m tools.soak --rate 1 --hours 48
+
+Every structure reported by /debug/memory is driven through its real code:
+UsageTracker, the prefetch cache, UsageAnalytics rollups and per-connection
+WebSocket conversation stores. Time is simulated with an injected clock, so
+a full day runs in seconds; only the upstream model is replaced by an
+in-process stand-in.
+
+Limits are raised to match the simulated rate, so the usage records hold a
+full 24h window rather than sitting at a cap. The first --warmup-hours let
+every 24h-retention structure fill; RSS must stay flat after that.
+"""
+from typing import List, Optional
+import argparse
+import asyncio
+import gc
+import json
+import random
+import sys
+
+from services.analytics import UsageAnalytics
+from services.conversation_store import ConversationStore
+from services.memory_monitor import get_rss_bytes, get_tracemalloc_stats, start_tracing
+from services.prefetcher import FOLLOW_UP_MESSAGES, FollowUpPrefetcher
+from services.thinking_engine import ThinkingEngine
+from services.usage_tracker import UsageTracker
+
+START_TIME = 1_700_000_000.0
+SAMPLE_MESSAGES = [
+    "なぜロケットはこんなに高いのか？",
+    "スタートアップの資金調達戦略を教えて",
+    "転職するべきか迷っている",
+    "電気自動車産業の未来は？",
+]
+SIMULATED_ANSWER = "やるしかない。" * 120  # Roughly the size of a capped response
+
+# Traffic shape
+CLIENTS = 500  # Distinct clients, well above the analytics per-bucket key cap
+CONNECTIONS = 50  # Concurrent WebSocket connections
+CONVERSATIONS_PER_CONNECTION = 12  # Above ws_max_conversations, so ends are exercised
+FOLLOW_UP_SHARE = 0.3  # Requests that are a predictable follow-up
+
+# RSS growth across post-warmup samples above which the run is reported as not flat
+MAX_GROWTH_RATIO = 0.05
+
+
+class _SimulatedUpstream:
+    """In-process stand-in for OpenAIClient; only the network call is replaced"""
+
+    model = "gpt-4o-mini"
+    in_flight = 0
+
+    async def get_response(self, prompt_data: dict) -> dict:
+        prompt_tokens = sum(len(m["content"]) for m in prompt_data["messages"]) // 2
+        return {
+            "content": SIMULATED_ANSWER,
+            "thinking_summary": None,
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": 400,
+                "total_tokens": prompt_tokens + 400
+            }
+        }
+
+
+def _memory_structures(tracker, prefetcher, analytics) -> dict:
+    """Same structure report as /debug/memory"""
+    return {
+        "usage_tracker": tracker.get_memory_stats(),
+        "prefetch_cache": prefetcher.get_memory_stats(),
+        "usage_analytics": analytics.get_memory_stats(),
+        "ws_conversations": ConversationStore.get_total_memory_stats()
+    }
+
+
+async def run_soak(rate: float, hours: int, warmup_hours: int, trace: bool, seed: int = 0) -> dict:
+    """Simulate traffic and return hourly RSS and structure samples"""
+    rng = random.Random(seed)
+    clock = [START_TIME]
+    now = lambda: clock[0]
+
+    requests_per_hour = int(rate * 3600)
+    tracker = UsageTracker(max_records=requests_per_hour * 24 * 2, clock=now)
+    # Twice the simulated traffic, so limits never block requests or prefetch headroom
+    tracker.apply_limits(tracker.limits._replace(
+        max_requests_per_minute=requests_per_hour * 2,
+        max_requests_per_hour=requests_per_hour * 2,
+        max_requests_per_day=requests_per_hour * 24 * 2,
+        max_tokens_per_day=2 ** 62
+    ))
+    engine = ThinkingEngine()
+    upstream = _SimulatedUpstream()
+    analytics = UsageAnalytics(clock=now)
+    prefetcher = FollowUpPrefetcher(engine, upstream, tracker, analytics=analytics, clock=now)
+    prefetcher.enabled = True
+
+    connections = [ConversationStore(max_conversations=8) for _ in range(CONNECTIONS)]
+    if trace:
+        start_tracing()
+
+    samples: List[dict] = []
+    step = 1.0 / rate
+    sent = 0
+
+    for hour in range(hours):
+        # Connections churn: one reconnects each hour with an empty store
+        connections[hour % CONNECTIONS] = ConversationStore(max_conversations=8)
+
+        for _ in range(requests_per_hour):
+            conversations = connections[sent % CONNECTIONS]
+            conversation_id = rng.randrange(CONVERSATIONS_PER_CONNECTION)
+            while not conversations.can_open(conversation_id):
+                conversations.end(rng.randrange(CONVERSATIONS_PER_CONNECTION))
+            history = conversations.history(conversation_id)
+
+            if history and rng.random() < FOLLOW_UP_SHARE:
+                message = rng.choice(FOLLOW_UP_MESSAGES)
+            else:
+                message = rng.choice(SAMPLE_MESSAGES)
+            prompt_data = engine.apply_thinking_style(user_message=message, mode="auto", history=history)
+
+            tracker.can_make_request()
+            response = prefetcher.lookup(prompt_data)
+            usage = None
+            if response is None:
+                response = await upstream.get_response(prompt_data)
+                usage = response["usage"]
+            tracker.record_request(usage["total_tokens"] if usage else 0)
+            analytics.record(
+                mode=prompt_data["mode"],
+                model=upstream.model,
+                client=f"client-{rng.randrange(CLIENTS)}",
+                latency_ms=rng.expovariate(1 / 900),
+                prompt_tokens=usage["prompt_tokens"] if usage else 0,
+                completion_tokens=usage["completion_tokens"] if usage else 0
+            )
+
+            prefetcher.schedule(message, response["content"], "auto", history)
+            while prefetcher.get_memory_stats()["pending_tasks"]:
+                await asyncio.sleep(0)
+            conversations.append_turn(conversation_id, message, response["content"])
+
+            clock[0] += step
+            sent += 1
+
+        gc.collect()
+        samples.append({
+            "hour": hour + 1,
+            "requests": sent,
+            "rss_bytes": get_rss_bytes(),
+            "structures": _memory_structures(tracker, prefetcher, analytics)
+        })
+
+    steady = [s["rss_bytes"] for s in samples[warmup_hours:] if s["rss_bytes"] is not None]
+    growth = (max(steady) - steady[0]) / steady[0] if len(steady) > 1 else 0.0
+    return {
+        "samples": samples,
+        "steady_state_from_hour": warmup_hours + 1,
+        "rss_growth_ratio": round(growth, 4),
+        "flat": growth <= MAX_GROWTH_RATIO,
+        "prefetch": prefetcher.get_stats(),
+        "tracemalloc": get_tracemalloc_stats(limit=5)
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Simulate days of traffic and check RSS stays flat")
+    parser.add_argument("--rate", type=float, default=1.0, help="Simulated requests per second")
+    parser.add_argument("--hours", type=int, default=48, help="Simulated hours")
+    parser.add_argument("--warmup-hours", type=int, default=24,
+                        help="Hours excluded from the flatness check while 24h windows fill")
+    parser.add_argument("--trace", action="store_true", help="Include tracemalloc top allocations")
+    args = parser.parse_args(argv)
+
+    if args.hours <= args.warmup_hours:
+        parser.error("--hours must be greater than --warmup-hours")
+
+    result = asyncio.run(run_soak(args.rate, args.hours, args.warmup_hours, args.trace))
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    return 0 if result["flat"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())